@@ -1,18 +1,21 @@
-import os
-import re
 import io
+import hmac
+import hashlib
 import tempfile
-import traceback
+from collections import deque
 from datetime import datetime, timedelta
 from typing import Tuple, Dict, Optional
 import pandas as pd
 import numpy as np
 import streamlit as st
-from openpyxl import Workbook
-from openpyxl.styles import Font, Alignment, PatternFill, Border, Side
-from openpyxl.utils.dataframe import dataframe_to_rows
-import warnings
-warnings.filterwarnings('ignore')
+
+# Lector Rust (python-calamine) para pd.read_excel; si no está instalado,
+# pandas elige openpyxl/xlrd según la extensión del archivo
+try:
+    import python_calamine  # noqa: F401
+    EXCEL_ENGINE = 'calamine'
+except ImportError:
+    EXCEL_ENGINE = None
 
 # ============================================================
 # CONFIGURACIÓN DE USUARIOS Y ROLES
@@ -45,6 +48,12 @@ USUARIOS = {
     }
 }
 
+# Digests SHA-256 calculados una vez al importar; el login compara digests en tiempo constante
+USUARIOS_HASH = {
+    usuario: hashlib.sha256(datos["password"].encode("utf-8")).digest()
+    for usuario, datos in USUARIOS.items()
+}
+
 # ============================================================
 # COLORES Y ESTILOS - BANDERA DE BOGOTÁ
 # ============================================================
@@ -60,6 +69,98 @@ BLACK = "#111111"
 MAX_INTENTOS = 5
 BLOQUEO_MINUTOS = 3
 MOSTRAR_INTENTOS = True
+MAX_HISTORIAL = 200  # accesos guardados por sesión; los más antiguos se descartan
+
+# ============================================================
+# CONFIGURACIÓN DEL ANÁLISIS
+# ============================================================
+COLUMNAS_PAC = ['PAC inicial', 'PAC Actual', 'PAC Reprogramado', 'Girado y Recaudado PAC', 'Disponibilidad PAC']
+CLAVES_CUBO = ['Per.presup.', 'Centro gestor', 'Fondos']
+UMBRALES_EJECUCION = [40.0, 60.0, 80.0]
+ETIQUETAS_EJECUCION = np.array(['❌ BAJO', '⚠️ REGULAR', '✓ BUENO', '✓ EXCELENTE'])
+
+# ============================================================
+# ESTILOS EXCEL (compartidos por todas las hojas)
+# ============================================================
+HEADER_FORMAT = {
+    'bold': True, 'font_color': WHITE, 'font_size': 11,
+    'bg_color': BOGOTA_RED, 'border': 1
+}
+TITLE_FORMAT = {'bold': True, 'font_size': 14, 'font_color': BOGOTA_RED}
+SUBTITLE_FORMAT = {'bold': True, 'font_size': 12}
+EXCEL_SPOOL_MAX = 8 * 1024 * 1024
+
+# ============================================================
+# CACHÉ DE ANÁLISIS (compartida por todas las sesiones del servidor)
+# ============================================================
+CACHE_MAX_ARCHIVOS = 4       # archivos distintos retenidos por cada función en caché
+CACHE_TTL_SEGUNDOS = 3600    # tras una hora sin uso se descartan
+
+# ============================================================
+# FORMATOS DE VISUALIZACIÓN (tablas en pantalla)
+# ============================================================
+FORMATO_MONEDA = '${:,.0f}'
+FILAS_POR_PAGINA = 50
+FORMATO_PERIODO = {
+    'PAC inicial': FORMATO_MONEDA,
+    'PAC Actual': FORMATO_MONEDA,
+    'PAC Reprogramado': FORMATO_MONEDA,
+    'Girado y Recaudado PAC': FORMATO_MONEDA,
+    'Disponibilidad PAC': FORMATO_MONEDA,
+    'Ejecución %': '{:.1f}%',
+    'Disponibilidad %': '{:.1f}%',
+    'Variación PAC': FORMATO_MONEDA,
+    'Variación %': '{:.1f}%'
+}
+FORMATO_RESUMEN = {
+    'PAC Actual': FORMATO_MONEDA,
+    'Girado y Recaudado PAC': FORMATO_MONEDA,
+    'Disponibilidad PAC': FORMATO_MONEDA,
+    'Ejecución %': '{:.1f}%'
+}
+
+# ============================================================
+# FUNCIONES AUXILIARES
+# ============================================================
+
+def _formato_detallado(columnas) -> Dict[str, str]:
+    """Formato de visualización de cada columna del análisis detallado"""
+    formato = {}
+    for col in columnas:
+        if 'PAC' in col or 'Girado' in col or 'Disponibilidad' in col:
+            formato[col] = FORMATO_MONEDA
+        elif 'Ejecutado' in col or '%' in col:
+            formato[col] = '{:.2f}%'
+    return formato
+
+def _formatear_tabla(df: pd.DataFrame, formatos: Dict[str, str]) -> pd.DataFrame:
+    """Copia de solo lectura con las columnas numéricas ya convertidas a texto formateado"""
+    return df.assign(**{
+        col: [fmt.format(v) for v in df[col].to_numpy()]
+        for col, fmt in formatos.items() if col in df.columns
+    })
+
+def _safe_pct(num, den):
+    """Calcula num / den * 100 en una sola pasada, con 0 donde den es 0 o algún valor falta"""
+    n = num.to_numpy(dtype=np.float64)
+    d = den.to_numpy(dtype=np.float64)
+    out = np.zeros_like(n)
+    # Igual que el .fillna(0) original: celdas vacías (NaN) también dan 0
+    np.divide(n, d, out=out, where=(d != 0) & ~np.isnan(n) & ~np.isnan(d))
+    out *= 100
+    return out
+
+def _escribir_nan_vacio(ws, fila, col, valor, formato=None):
+    """Handler de xlsxwriter: NaN se escribe como celda vacía (como openpyxl), no como #NUM!"""
+    if valor != valor:
+        return ws.write_blank(fila, col, None, formato)
+    return ws.write_number(fila, col, valor, formato)
+
+def _clasificar_ejecucion_vec(porcentajes):
+    """Clasifica un arreglo de % de ejecución (<40, 40-60, 60-80, >=80) sin bucles Python"""
+    idx = np.searchsorted(UMBRALES_EJECUCION, porcentajes, side='right')
+    idx[np.isnan(porcentajes)] = 0
+    return ETIQUETAS_EJECUCION[idx]
 
 # ============================================================
 # CLASE ANALIZADOR PAC
@@ -71,14 +172,38 @@ class AnalizadorPAC:
         self.df = df
         self.resumen_periodo = None
         self.resumen_centro = None
+        self.resumen_centro_top3 = None
         self.resumen_fondos = None
         self.resumen_detallado = None
+        self.cubo = None
+        self.ejecucion_registros = None
         self.analisis = {}
         
     def limpiar_datos(self):
         """Limpia datos eliminando filas totales y NaN"""
-        self.df = self.df[self.df['Per.presup.'].notna()]
-        self.df = self.df[self.df['Centro gestor'].notna()]
+        # Una sola máscara y una sola copia en lugar de dos filtros encadenados
+        mask = (self.df['Per.presup.'].notna().to_numpy()
+                & self.df['Centro gestor'].notna().to_numpy())
+        self.df = self.df.loc[mask]
+        
+        # Claves repetidas como category: groupby y orden trabajan sobre códigos enteros
+        claves = ('Centro gestor', 'Fondos', 'Progr.financiación', 'Pos.presupuestaria', 'Per.presup.')
+        self.df = self.df.astype({col: 'category' for col in claves if col in self.df.columns})
+        
+        # Ordenar una sola vez; los groupby y el detallado reutilizan este orden
+        self.df = self.df.sort_values(['Per.presup.', 'Centro gestor'], kind='stable').reset_index(drop=True)
+        return self
+    
+    def run_all(self):
+        """Ejecuta el análisis completo: una pasada de groupby (el cubo) alimenta los tres resúmenes"""
+        self.limpiar_datos()
+        self._cubo()
+        self.resumen_detallado_completo()
+        self.resumen_por_periodo()
+        self.resumen_por_centro()
+        self.resumen_por_fondos()
+        self.analisis_disponibilidad()
+        self.analisis_ejecucion()
         return self
     
     def resumen_detallado_completo(self):
@@ -117,101 +242,108 @@ class AnalizadorPAC:
         
         # Calcular % Ejecutado
         if 'PAC Actual' in self.resumen_detallado.columns and 'Girado y Recaudado PAC' in self.resumen_detallado.columns:
-            self.resumen_detallado['% Ejecutado'] = (
-                self.resumen_detallado['Girado y Recaudado PAC'] / 
-                self.resumen_detallado['PAC Actual'] * 100
-            ).fillna(0)
+            pct = self._ejecucion_por_registro()
+            self.resumen_detallado['% Ejecutado'] = pct
+            self.resumen_detallado['Estado'] = _clasificar_ejecucion_vec(pct)
         
         # Renombrar columnas para mejor visualización
         self.resumen_detallado = self.resumen_detallado.rename(columns=columnas_renombrar)
         
-        # Ordenar por Período y Centro Gestor si existen
-        columnas_orden = []
-        if 'Período' in self.resumen_detallado.columns:
-            columnas_orden.append('Período')
-        if 'Centro Gestor' in self.resumen_detallado.columns:
-            columnas_orden.append('Centro Gestor')
-        
-        if columnas_orden:
-            self.resumen_detallado = self.resumen_detallado.sort_values(columnas_orden)
-        
+        # self.df ya viene ordenado por Período y Centro Gestor desde limpiar_datos
         # Resetear el índice
         self.resumen_detallado = self.resumen_detallado.reset_index(drop=True)
         
         return self.resumen_detallado
     
+    def _ejecucion_por_registro(self):
+        """% de ejecución de cada registro, calculado una sola vez y compartido por el detallado y la ejecución"""
+        if self.ejecucion_registros is None:
+            self.ejecucion_registros = _safe_pct(
+                self.df['Girado y Recaudado PAC'],
+                self.df['PAC Actual']
+            )
+        return self.ejecucion_registros
+    
+    def _cubo(self):
+        """Pre-agrega una sola vez las columnas PAC por período, centro gestor y fondos"""
+        if self.cubo is None:
+            # dropna=False: un registro sin fondos sigue contando en período y centro
+            self.cubo = self.df.groupby(
+                CLAVES_CUBO, sort=False, observed=True, dropna=False
+            )[COLUMNAS_PAC].sum()
+        return self.cubo
+    
+    def _resumir_cubo(self, clave, columnas):
+        """Suma el cubo pre-agregado sobre uno de sus niveles"""
+        return self._cubo().groupby(level=clave, sort=False, observed=True)[columnas].sum().reset_index()
+    
     def resumen_por_periodo(self):
         """Genera resumen financiero por período presupuestal"""
-        self.resumen_periodo = self.df.groupby('Per.presup.').agg({
-            'PAC inicial': 'sum',
-            'PAC Actual': 'sum',
-            'PAC Reprogramado': 'sum',
-            'Girado y Recaudado PAC': 'sum',
-            'Disponibilidad PAC': 'sum'
-        }).reset_index()
+        self.resumen_periodo = self._resumir_cubo('Per.presup.', COLUMNAS_PAC)
         
-        self.resumen_periodo['Ejecución %'] = (
-            self.resumen_periodo['Girado y Recaudado PAC'] / 
-            self.resumen_periodo['PAC Actual'] * 100
-        ).fillna(0)
+        self.resumen_periodo['Ejecución %'] = _safe_pct(
+            self.resumen_periodo['Girado y Recaudado PAC'],
+            self.resumen_periodo['PAC Actual']
+        )
         
-        self.resumen_periodo['Disponibilidad %'] = (
-            self.resumen_periodo['Disponibilidad PAC'] / 
-            self.resumen_periodo['PAC Actual'] * 100
-        ).fillna(0)
+        self.resumen_periodo['Disponibilidad %'] = _safe_pct(
+            self.resumen_periodo['Disponibilidad PAC'],
+            self.resumen_periodo['PAC Actual']
+        )
         
         self.resumen_periodo['Variación PAC'] = (
             self.resumen_periodo['PAC Actual'] - 
             self.resumen_periodo['PAC inicial']
         )
         
-        self.resumen_periodo['Variación %'] = (
-            self.resumen_periodo['Variación PAC'] / 
-            self.resumen_periodo['PAC inicial'] * 100
-        ).fillna(0)
+        self.resumen_periodo['Variación %'] = _safe_pct(
+            self.resumen_periodo['Variación PAC'],
+            self.resumen_periodo['PAC inicial']
+        )
         
         return self.resumen_periodo
     
     def resumen_por_centro(self):
         """Genera resumen por centro gestor"""
-        self.resumen_centro = self.df.groupby('Centro gestor').agg({
-            'PAC Actual': 'sum',
-            'Girado y Recaudado PAC': 'sum',
-            'Disponibilidad PAC': 'sum'
-        }).reset_index()
+        columnas = ['PAC Actual', 'Girado y Recaudado PAC', 'Disponibilidad PAC']
+        self.resumen_centro = self._resumir_cubo('Centro gestor', columnas)
         
-        self.resumen_centro['Ejecución %'] = (
-            self.resumen_centro['Girado y Recaudado PAC'] / 
-            self.resumen_centro['PAC Actual'] * 100
-        ).fillna(0)
+        self.resumen_centro['Ejecución %'] = _safe_pct(
+            self.resumen_centro['Girado y Recaudado PAC'],
+            self.resumen_centro['PAC Actual']
+        )
         
+        # Las interpretaciones solo necesitan los 3 mayores: selección parcial
+        self.resumen_centro_top3 = self.resumen_centro.nlargest(3, 'PAC Actual')
+        
+        # El orden completo se mantiene para la pestaña y la hoja exportada
         self.resumen_centro = self.resumen_centro.sort_values('PAC Actual', ascending=False)
         return self.resumen_centro
     
     def resumen_por_fondos(self):
         """Genera resumen por tipo de fondos"""
-        self.resumen_fondos = self.df.groupby('Fondos').agg({
-            'PAC Actual': 'sum',
-            'Girado y Recaudado PAC': 'sum',
-            'Disponibilidad PAC': 'sum'
-        }).reset_index()
+        columnas = ['PAC Actual', 'Girado y Recaudado PAC', 'Disponibilidad PAC']
+        self.resumen_fondos = self._resumir_cubo('Fondos', columnas)
         
-        self.resumen_fondos['Ejecución %'] = (
-            self.resumen_fondos['Girado y Recaudado PAC'] / 
-            self.resumen_fondos['PAC Actual'] * 100
-        ).fillna(0)
+        self.resumen_fondos['Ejecución %'] = _safe_pct(
+            self.resumen_fondos['Girado y Recaudado PAC'],
+            self.resumen_fondos['PAC Actual']
+        )
         
         self.resumen_fondos = self.resumen_fondos.sort_values('PAC Actual', ascending=False)
         return self.resumen_fondos
     
     def analisis_disponibilidad(self):
         """Analiza la disponibilidad presupuestal"""
-        total_pac = self.df['PAC Actual'].sum()
-        total_ejecutado = self.df['Girado y Recaudado PAC'].sum()
-        total_disponible = self.df['Disponibilidad PAC'].sum()
+        disp = self.df['Disponibilidad PAC'].to_numpy(dtype=np.float64)
+        
+        total_pac = float(np.nansum(self.df['PAC Actual'].to_numpy(dtype=np.float64)))
+        total_ejecutado = float(np.nansum(self.df['Girado y Recaudado PAC'].to_numpy(dtype=np.float64)))
+        total_disponible = float(np.nansum(disp))
         
-        sobregiros = self.df[self.df['Disponibilidad PAC'] < 0]
-        total_sobregiro = sobregiros['Disponibilidad PAC'].sum()
+        # Máscara de sobregiros calculada una vez, sin copiar filas del DataFrame
+        sobregiro = disp < 0
+        total_sobregiro = float(disp[sobregiro].sum())
         
         self.analisis['disponibilidad'] = {
             'total_pac': total_pac,
@@ -219,7 +351,7 @@ class AnalizadorPAC:
             'total_disponible': total_disponible,
             'ejecucion_pct': (total_ejecutado / total_pac * 100) if total_pac > 0 else 0,
             'disponibilidad_pct': (total_disponible / total_pac * 100) if total_pac > 0 else 0,
-            'registros_sobregiro': len(sobregiros),
+            'registros_sobregiro': int(sobregiro.sum()),
             'total_sobregiro': total_sobregiro
         }
         
@@ -227,20 +359,18 @@ class AnalizadorPAC:
     
     def analisis_ejecucion(self):
         """Analiza la ejecución presupuestal"""
-        self.df['Ejecución %'] = (
-            self.df['Girado y Recaudado PAC'] / 
-            self.df['PAC Actual'] * 100
-        ).fillna(0)
+        pct = self._ejecucion_por_registro()
+        self.df['Ejecución %'] = pct
         
-        alta = len(self.df[self.df['Ejecución %'] >= 80])
-        media = len(self.df[(self.df['Ejecución %'] >= 50) & (self.df['Ejecución %'] < 80)])
-        baja = len(self.df[self.df['Ejecución %'] < 50])
+        # Conteo por rangos (<50, 50-80, >=80) en una sola pasada
+        conteos = np.bincount(np.searchsorted([50.0, 80.0], pct, side='right'), minlength=3)
+        baja, media, alta = (int(n) for n in conteos)
         
         self.analisis['ejecucion'] = {
             'alta': alta,
             'media': media,
             'baja': baja,
-            'promedio_ejecucion': self.df['Ejecución %'].mean()
+            'promedio_ejecucion': pct.mean()
         }
         
         return self.analisis['ejecucion']
@@ -274,16 +404,18 @@ class AnalizadorPAC:
             })
         
         if len(self.resumen_periodo) > 0:
-            mejor_periodo = self.resumen_periodo.loc[
-                self.resumen_periodo['Ejecución %'].idxmax()
-            ]
+            # Valores tomados directamente de los arreglos NumPy de la mejor fila
+            ejecucion = self.resumen_periodo['Ejecución %'].to_numpy()
+            idx = int(ejecucion.argmax())
+            periodo = int(self.resumen_periodo['Per.presup.'].iat[idx])
+            girado = float(self.resumen_periodo['Girado y Recaudado PAC'].to_numpy()[idx])
             interpretaciones.append({
                 'Categoría': 'EJECUCIÓN POR PERÍODO',
-                'Hallazgo': f"Período {int(mejor_periodo['Per.presup.'])} tiene mejor ejecución",
+                'Hallazgo': f"Período {periodo} tiene mejor ejecución",
                 'Interpretación': (
-                    f"El período {int(mejor_periodo['Per.presup.'])} muestra la mayor ejecución "
-                    f"con {mejor_periodo['Ejecución %']:.1f}% del PAC ejecutado. "
-                    f"Girado: ${mejor_periodo['Girado y Recaudado PAC']:,.0f}"
+                    f"El período {periodo} muestra la mayor ejecución "
+                    f"con {float(ejecucion[idx]):.1f}% del PAC ejecutado. "
+                    f"Girado: ${girado:,.0f}"
                 ),
                 'Estado': '✓ POSITIVO'
             })
@@ -300,15 +432,17 @@ class AnalizadorPAC:
             'Estado': self._clasificar_ejecucion(ejec['promedio_ejecucion'])
         })
         
-        if len(self.resumen_centro) >= 3:
-            top3 = self.resumen_centro.head(3)
+        if len(self.resumen_centro_top3) >= 3:
+            top3_pac = float(self.resumen_centro_top3['PAC Actual'].to_numpy()[:3].sum())
+            top3_centros = self.resumen_centro_top3['Centro gestor'].to_numpy()[:3].tolist()
+            pct_top3 = top3_pac / disp['total_pac'] * 100 if disp['total_pac'] > 0 else 0
             interpretaciones.append({
                 'Categoría': 'PRINCIPALES CENTROS GESTORES',
-                'Hallazgo': f"Top 3 concentran ${top3['PAC Actual'].sum():,.0f}",
+                'Hallazgo': f"Top 3 concentran ${top3_pac:,.0f}",
                 'Interpretación': (
                     f"Los 3 principales centros gestores son: "
-                    f"{', '.join(top3['Centro gestor'].tolist())}. "
-                    f"Juntos representan el {(top3['PAC Actual'].sum() / disp['total_pac'] * 100):.1f}% "
+                    f"{', '.join(map(str, top3_centros))}. "
+                    f"Juntos representan el {pct_top3:.1f}% "
                     f"del PAC total."
                 ),
                 'Estado': '📊 INFO'
@@ -318,43 +452,49 @@ class AnalizadorPAC:
     
     def _clasificar_ejecucion(self, porcentaje):
         """Clasifica el nivel de ejecución"""
-        if porcentaje >= 80:
-            return '✓ EXCELENTE'
-        elif porcentaje >= 60:
-            return '✓ BUENO'
-        elif porcentaje >= 40:
-            return '⚠️ REGULAR'
-        else:
-            return '❌ BAJO'
+        return str(_clasificar_ejecucion_vec(np.asarray([porcentaje], dtype=np.float64))[0])
     
     def exportar_excel(self):
-        """Exporta todos los análisis a Excel"""
-        wb = Workbook()
-        wb.remove(wb.active)
+        """Exporta todos los análisis a Excel y devuelve el contenido del archivo"""
+        # Import diferido: xlsxwriter solo se carga cuando se genera un reporte
+        import xlsxwriter
         
+        # Hasta EXCEL_SPOOL_MAX el archivo vive en memoria; por encima pasa a disco
+        with tempfile.SpooledTemporaryFile(max_size=EXCEL_SPOOL_MAX, suffix='.xlsx') as tmp:
+            wb = xlsxwriter.Workbook(tmp, {
+                'constant_memory': True,
+                'nan_inf_to_errors': True,
+                'strings_to_urls': False
+            })
+            self._escribir_hojas(wb)
+            wb.close()
+            
+            tmp.seek(0)
+            return tmp.read()
+    
+    def _escribir_hojas(self, wb):
+        """Escribe las seis hojas del reporte con XlsxWriter en modo constant_memory"""
         # Estilos
-        header_fill = PatternFill(start_color='DA121A', end_color='DA121A', fill_type='solid')
-        header_font = Font(bold=True, color='FFFFFF', size=11)
-        title_font = Font(bold=True, size=14, color='DA121A')
-        border = Border(
-            left=Side(style='thin'),
-            right=Side(style='thin'),
-            top=Side(style='thin'),
-            bottom=Side(style='thin')
-        )
+        fmt = {
+            'titulo': wb.add_format(TITLE_FORMAT),
+            'subtitulo': wb.add_format(SUBTITLE_FORMAT),
+            'encabezado': wb.add_format(HEADER_FORMAT),
+            'moneda': wb.add_format({'num_format': '$#,##0'}),
+            'pct': wb.add_format({'num_format': '0.0'}),
+            'pct2': wb.add_format({'num_format': '0.00'}),
+            'ajuste': wb.add_format({'text_wrap': True, 'valign': 'top'})
+        }
         
         # Hoja 1: Resumen Ejecutivo
-        ws1 = wb.create_sheet('Resumen Ejecutivo')
-        ws1['A1'] = 'ANÁLISIS COMPLETO DEL REPORTE PAC'
-        ws1['A1'].font = title_font
-        ws1.merge_cells('A1:D1')
+        ws1 = wb.add_worksheet('Resumen Ejecutivo')
+        for idx, ancho in enumerate((25, 20, 12, 15)):
+            ws1.set_column(idx, idx, ancho)
         
-        ws1['A3'] = 'INDICADORES GENERALES'
-        ws1['A3'].font = Font(bold=True, size=12)
+        ws1.merge_range(0, 0, 0, 3, 'ANÁLISIS COMPLETO DEL REPORTE PAC', fmt['titulo'])
+        ws1.write(2, 0, 'INDICADORES GENERALES', fmt['subtitulo'])
         
         disp = self.analisis['disponibilidad']
         metricas = [
-            ['Métrica', 'Valor', 'Unidad', 'Estado'],
             ['PAC Total', disp['total_pac'], '$', ''],
             ['Girado y Recaudado', disp['total_ejecutado'], '$', ''],
             ['Disponibilidad', disp['total_disponible'], '$', ''],
@@ -364,153 +504,147 @@ class AnalizadorPAC:
              '⚠️ CRÍTICO' if disp['registros_sobregiro'] > 0 else '✓ OK']
         ]
         
-        for row_idx, row_data in enumerate(metricas, start=4):
-            for col_idx, value in enumerate(row_data, start=1):
-                cell = ws1.cell(row=row_idx, column=col_idx, value=value)
-                if row_idx == 4:
-                    cell.fill = header_fill
-                    cell.font = header_font
-                cell.border = border
-                if col_idx == 2 and row_idx > 4:
-                    if row_data[2] == '$':
-                        cell.number_format = '$#,##0'
-                    elif row_data[2] == '%':
-                        cell.number_format = '0.0'
-        
-        ws1.column_dimensions['A'].width = 25
-        ws1.column_dimensions['B'].width = 20
-        ws1.column_dimensions['C'].width = 12
-        ws1.column_dimensions['D'].width = 15
-        
-        # Hoja 2: Análisis Detallado
-        ws2 = wb.create_sheet('Análisis Detallado')
-        ws2['A1'] = 'ANÁLISIS DETALLADO COMPLETO'
-        ws2['A1'].font = title_font
+        ws1.write_row(3, 0, ['Métrica', 'Valor', 'Unidad', 'Estado'], fmt['encabezado'])
+        for r_idx, (metrica, valor, unidad, estado) in enumerate(metricas, start=4):
+            formato = {'$': fmt['moneda'], '%': fmt['pct']}.get(unidad)
+            ws1.write(r_idx, 0, metrica)
+            ws1.write(r_idx, 1, valor, formato)
+            ws1.write(r_idx, 2, unidad)
+            ws1.write(r_idx, 3, estado)
         
-        if self.resumen_detallado is not None and len(self.resumen_detallado) > 0:
-            num_cols = len(self.resumen_detallado.columns)
-            ws2.merge_cells(f'A1:{chr(64 + num_cols)}1')
-            
-            for r_idx, row in enumerate(dataframe_to_rows(self.resumen_detallado, index=False, header=True), start=3):
-                for c_idx, value in enumerate(row, start=1):
-                    cell = ws2.cell(row=r_idx, column=c_idx, value=value)
-                    if r_idx == 3:
-                        cell.fill = header_fill
-                        cell.font = header_font
-                    cell.border = border
-                    
-                    # Formatear números
-                    if r_idx > 3:
-                        col_name = self.resumen_detallado.columns[c_idx - 1]
-                        if 'PAC' in col_name or 'Girado' in col_name or 'Disponibilidad' in col_name:
-                            cell.number_format = '$#,##0'
-                        elif '%' in col_name or 'Ejecutado' in col_name:
-                            cell.number_format = '0.00'
-            
-            # Ajustar anchos
-            for idx, col in enumerate(self.resumen_detallado.columns, start=1):
-                col_letter = chr(64 + idx)
+        # Hoja 2: Análisis Detallado (formato y ancho según el nombre de la columna)
+        formatos_detallado, anchos_detallado = [], []
+        if self.resumen_detallado is not None:
+            for col in self.resumen_detallado.columns:
+                if 'PAC' in col or 'Girado' in col or 'Disponibilidad' in col:
+                    formatos_detallado.append(fmt['moneda'])
+                elif '%' in col or 'Ejecutado' in col:
+                    formatos_detallado.append(fmt['pct2'])
+                else:
+                    formatos_detallado.append(None)
+                
                 if 'Pos.Presupuestaria' in col or 'Programa' in col:
-                    ws2.column_dimensions[col_letter].width = 25
+                    anchos_detallado.append(25)
                 elif 'Centro' in col:
-                    ws2.column_dimensions[col_letter].width = 20
+                    anchos_detallado.append(20)
                 else:
-                    ws2.column_dimensions[col_letter].width = 18
-        
-        # Hoja 3: Por Período
-        ws3 = wb.create_sheet('Por Período')
-        ws3['A1'] = 'ANÁLISIS POR PERÍODO PRESUPUESTAL'
-        ws3['A1'].font = title_font
-        ws3.merge_cells('A1:I1')
+                    anchos_detallado.append(18)
         
-        for r_idx, row in enumerate(dataframe_to_rows(self.resumen_periodo, index=False, header=True), start=3):
-            for c_idx, value in enumerate(row, start=1):
-                cell = ws3.cell(row=r_idx, column=c_idx, value=value)
-                if r_idx == 3:
-                    cell.fill = header_fill
-                    cell.font = header_font
-                cell.border = border
-                
-                if r_idx > 3 and c_idx >= 2:
-                    if c_idx in [7, 8, 10]:
-                        cell.number_format = '0.0'
-                    else:
-                        cell.number_format = '$#,##0'
-        
-        for col_letter in ['A', 'B', 'C', 'D', 'E', 'F', 'G', 'H', 'I', 'J']:
-            ws3.column_dimensions[col_letter].width = 18
-        
-        # Hoja 4: Por Centro Gestor
-        ws4 = wb.create_sheet('Por Centro Gestor')
-        ws4['A1'] = 'ANÁLISIS POR CENTRO GESTOR'
-        ws4['A1'].font = title_font
-        ws4.merge_cells('A1:E1')
-        
-        for r_idx, row in enumerate(dataframe_to_rows(self.resumen_centro, index=False, header=True), start=3):
-            for c_idx, value in enumerate(row, start=1):
-                cell = ws4.cell(row=r_idx, column=c_idx, value=value)
-                if r_idx == 3:
-                    cell.fill = header_fill
-                    cell.font = header_font
-                cell.border = border
-                
-                if r_idx > 3 and c_idx >= 2:
-                    if c_idx == 5:
-                        cell.number_format = '0.0'
-                    else:
-                        cell.number_format = '$#,##0'
-        
-        for col_letter in ['A', 'B', 'C', 'D', 'E']:
-            ws4.column_dimensions[col_letter].width = 20
-        
-        # Hoja 5: Por Fondos
-        ws5 = wb.create_sheet('Por Fondos')
-        ws5['A1'] = 'ANÁLISIS POR TIPO DE FONDOS'
-        ws5['A1'].font = title_font
-        ws5.merge_cells('A1:E1')
+        # Hojas 2 a 6: una configuración por hoja, escritas por el mismo helper
+        formatos_resumen = [None, fmt['moneda'], fmt['moneda'], fmt['moneda'], fmt['pct']]
+        hojas = [
+            {
+                'nombre': 'Análisis Detallado',
+                'titulo': 'ANÁLISIS DETALLADO COMPLETO',
+                'df': self.resumen_detallado,
+                'formatos': formatos_detallado,
+                'anchos': anchos_detallado
+            },
+            {
+                'nombre': 'Por Período',
+                'titulo': 'ANÁLISIS POR PERÍODO PRESUPUESTAL',
+                'df': self.resumen_periodo,
+                'formatos': [None] + [
+                    fmt['pct'] if c_idx in (6, 7, 9) else fmt['moneda']
+                    for c_idx in range(1, len(self.resumen_periodo.columns))
+                ],
+                'anchos': [18] * len(self.resumen_periodo.columns)
+            },
+            {
+                'nombre': 'Por Centro Gestor',
+                'titulo': 'ANÁLISIS POR CENTRO GESTOR',
+                'df': self.resumen_centro,
+                'formatos': formatos_resumen,
+                'anchos': [20] * 5
+            },
+            {
+                'nombre': 'Por Fondos',
+                'titulo': 'ANÁLISIS POR TIPO DE FONDOS',
+                'df': self.resumen_fondos,
+                'formatos': formatos_resumen,
+                'anchos': [20] * 5
+            },
+            {
+                'nombre': 'Interpretaciones',
+                'titulo': 'INTERPRETACIÓN Y HALLAZGOS DEL ANÁLISIS',
+                'df': self.generar_interpretaciones(),
+                'formatos': [fmt['ajuste']] * 4,
+                'anchos': [20, 35, 60, 15],
+                'alto_fila': 45
+            }
+        ]
         
-        for r_idx, row in enumerate(dataframe_to_rows(self.resumen_fondos, index=False, header=True), start=3):
-            for c_idx, value in enumerate(row, start=1):
-                cell = ws5.cell(row=r_idx, column=c_idx, value=value)
-                if r_idx == 3:
-                    cell.fill = header_fill
-                    cell.font = header_font
-                cell.border = border
-                
-                if r_idx > 3 and c_idx >= 2:
-                    if c_idx == 5:
-                        cell.number_format = '0.0'
-                    else:
-                        cell.number_format = '$#,##0'
+        for hoja in hojas:
+            self._escribir_hoja_df(wb, fmt, **hoja)
+    
+    def _escribir_hoja_df(self, wb, fmt, nombre, titulo, df, formatos, anchos, alto_fila=None):
+        """Escribe una hoja con título, encabezado y filas de un DataFrame a partir de la fila 3
         
-        for col_letter in ['A', 'B', 'C', 'D', 'E']:
-            ws5.column_dimensions[col_letter].width = 20
+        El formato y ancho de cada columna se asignan con set_column, así las filas
+        se escriben con un solo write_row y sin formato por celda.
+        """
+        ws = wb.add_worksheet(nombre)
+        # Celdas vacías del origen (montos o categorías NaN) quedan vacías;
+        # nan_inf_to_errors solo aplica ya a valores infinitos
+        ws.add_write_handler(float, _escribir_nan_vacio)
+        ws.add_write_handler(np.float64, _escribir_nan_vacio)
         
-        # Hoja 6: Interpretaciones
-        interpretaciones_df = self.generar_interpretaciones()
-        ws6 = wb.create_sheet('Interpretaciones')
-        ws6['A1'] = 'INTERPRETACIÓN Y HALLAZGOS DEL ANÁLISIS'
-        ws6['A1'].font = title_font
-        ws6.merge_cells('A1:D1')
+        if df is None or len(df) == 0:
+            ws.write(0, 0, titulo, fmt['titulo'])
+            return ws
         
-        for r_idx, row in enumerate(dataframe_to_rows(interpretaciones_df, index=False, header=True), start=3):
-            for c_idx, value in enumerate(row, start=1):
-                cell = ws6.cell(row=r_idx, column=c_idx, value=value)
-                if r_idx == 3:
-                    cell.fill = header_fill
-                    cell.font = header_font
-                cell.border = border
-                cell.alignment = Alignment(wrap_text=True, vertical='top')
+        for idx, (formato, ancho) in enumerate(zip(formatos, anchos)):
+            ws.set_column(idx, idx, ancho, formato)
         
-        ws6.column_dimensions['A'].width = 20
-        ws6.column_dimensions['B'].width = 35
-        ws6.column_dimensions['C'].width = 60
-        ws6.column_dimensions['D'].width = 15
+        ws.merge_range(0, 0, 0, len(df.columns) - 1, titulo, fmt['titulo'])
+        ws.write_row(2, 0, list(df.columns), fmt['encabezado'])
         
-        for row in ws6.iter_rows(min_row=4, max_row=ws6.max_row):
-            ws6.row_dimensions[row[0].row].height = 45
+        for r_idx, row in enumerate(df.itertuples(index=False, name=None), start=3):
+            if alto_fila is not None:
+                ws.set_row(r_idx, alto_fila)
+            ws.write_row(r_idx, 0, row)
         
-        return wb
+        return ws
+
+# ============================================================
+# ANÁLISIS EN CACHÉ (se reutiliza entre reruns de Streamlit)
+# ============================================================
+
+# Las funciones se indexan por el SHA-256 del archivo (file_hash); los bytes van
+# como _file_bytes para que Streamlit no los vuelva a hashear en cada rerun
+
+@st.cache_data(show_spinner=False, max_entries=CACHE_MAX_ARCHIVOS, ttl=CACHE_TTL_SEGUNDOS)
+def _load_pac(file_hash: str, _file_bytes: bytes) -> pd.DataFrame:
+    """Lee la hoja 'Data' del archivo PAC una sola vez por contenido"""
+    return pd.read_excel(io.BytesIO(_file_bytes), sheet_name='Data', engine=EXCEL_ENGINE)
+
+@st.cache_data(show_spinner=False, max_entries=CACHE_MAX_ARCHIVOS, ttl=CACHE_TTL_SEGUNDOS)
+def ejecutar_analisis(file_hash: str, _file_bytes: bytes) -> Dict:
+    """Ejecuta el análisis completo de un archivo PAC; el resultado queda en caché por contenido"""
+    df = _load_pac(file_hash, _file_bytes)
+    
+    analizador = AnalizadorPAC(df).run_all()
+    
+    # Tablas de pantalla formateadas una sola vez (sin Styler en cada render)
+    detallado = analizador.resumen_detallado
+    vistas = {
+        'detallado': _formatear_tabla(detallado, _formato_detallado(detallado.columns)),
+        'periodo': _formatear_tabla(analizador.resumen_periodo, FORMATO_PERIODO),
+        'centro': _formatear_tabla(analizador.resumen_centro.head(20), FORMATO_RESUMEN),
+        'fondos': _formatear_tabla(analizador.resumen_fondos, FORMATO_RESUMEN)
+    }
+    
+    return {
+        'analizador': analizador,
+        'interpretaciones': analizador.generar_interpretaciones(),
+        'vistas': vistas
+    }
+
+@st.cache_data(show_spinner=False, max_entries=CACHE_MAX_ARCHIVOS, ttl=CACHE_TTL_SEGUNDOS)
+def generar_excel_bytes(file_hash: str, _analizador: AnalizadorPAC) -> bytes:
+    """Genera el reporte Excel una sola vez por archivo (file_hash es la clave de caché;
+    _analizador no se hashea)"""
+    return _analizador.exportar_excel()
 
 # ============================================================
 # FUNCIONES DE AUTENTICACIÓN
@@ -519,8 +653,10 @@ class AnalizadorPAC:
 def validar_login(user: str, password: str) -> Tuple[bool, Optional[Dict]]:
     """Valida las credenciales del usuario"""
     user = user.strip().lower()
-    if user in USUARIOS:
-        if USUARIOS[user]["password"] == password:
+    esperado = USUARIOS_HASH.get(user)
+    if esperado is not None:
+        recibido = hashlib.sha256(password.encode("utf-8")).digest()
+        if hmac.compare_digest(recibido, esperado):
             return True, USUARIOS[user]
     return False, None
 
@@ -528,7 +664,159 @@ def tiene_permiso(permiso: str) -> bool:
     """Verifica si el usuario actual tiene un permiso específico"""
     if not st.session_state.logged_in:
         return False
-    return permiso in st.session_state.get("permisos", [])
+    return permiso in st.session_state.permisos
+
+def procesar_login():
+    """Callback del botón Ingresar: actualiza la sesión antes del rerun del envío del formulario"""
+    usuario = st.session_state.login_usuario
+    exito, datos_usuario = validar_login(usuario, st.session_state.login_clave)
+    
+    if exito:
+        st.session_state.logged_in = True
+        st.session_state.user = usuario.strip().lower()
+        st.session_state.rol = datos_usuario["rol"]
+        st.session_state.permisos = frozenset(datos_usuario["permisos"])
+        st.session_state.failed_attempts = 0
+        
+        st.session_state.historial_accesos.append({
+            "usuario": st.session_state.user,
+            "fecha": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "resultado": "Exitoso"
+        })
+    else:
+        st.session_state.failed_attempts += 1
+        
+        st.session_state.historial_accesos.append({
+            "usuario": usuario,
+            "fecha": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "resultado": "Fallido"
+        })
+        
+        if st.session_state.failed_attempts >= MAX_INTENTOS:
+            st.session_state.lock_until = datetime.now() + timedelta(minutes=BLOQUEO_MINUTOS)
+            st.session_state.failed_attempts = 0
+
+def cerrar_sesion():
+    """Callback del botón Cerrar Sesión"""
+    st.session_state.logged_in = False
+    st.session_state.user = ""
+    st.session_state.rol = ""
+    st.session_state.permisos = frozenset()
+    st.session_state.failed_attempts = 0
+    st.session_state.lock_until = None
+    st.session_state.analysis_key = None
+
+# ============================================================
+# RESULTADOS DEL ANÁLISIS
+# ============================================================
+
+@st.fragment
+def mostrar_resultados(file_hash: str, resultados: Dict):
+    """Muestra métricas, pestañas y descarga; sus widgets solo re-ejecutan este fragmento"""
+    analizador = resultados['analizador']
+    interpretaciones = resultados['interpretaciones']
+    vistas = resultados['vistas']
+    
+    # Mostrar métricas principales
+    st.markdown("### 📊 Métricas Principales")
+    
+    disp = analizador.analisis['disponibilidad']
+    
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric(
+        "💰 PAC Total",
+        f"${disp['total_pac']:,.0f}"
+    )
+    col2.metric(
+        "✅ Ejecutado",
+        f"${disp['total_ejecutado']:,.0f}",
+        f"{disp['ejecucion_pct']:.1f}%"
+    )
+    col3.metric(
+        "📊 Disponible",
+        f"${disp['total_disponible']:,.0f}",
+        f"{disp['disponibilidad_pct']:.1f}%"
+    )
+    col4.metric(
+        "⚠️ Sobregiros",
+        disp['registros_sobregiro'],
+        "CRÍTICO" if disp['registros_sobregiro'] > 0 else "OK"
+    )
+    
+    st.markdown("---")
+    
+    # Tabs de resultados
+    result_tab1, result_tab2, result_tab3, result_tab4, result_tab5 = st.tabs([
+        "📊 Análisis Detallado", "📅 Por Período", "🏢 Por Centro", "💰 Por Fondos", "🔍 Interpretaciones"
+    ])
+    
+    with result_tab1:
+        st.markdown("#### 📊 Análisis Detallado Completo")
+        if analizador.resumen_detallado is not None and len(analizador.resumen_detallado) > 0:
+            # Solo se envía la página visible; el detalle completo va en el Excel
+            total = len(vistas['detallado'])
+            paginas = -(-total // FILAS_POR_PAGINA)
+            pagina = st.number_input("Página", min_value=1, max_value=paginas, value=1, step=1)
+            inicio = (pagina - 1) * FILAS_POR_PAGINA
+            st.dataframe(
+                vistas['detallado'].iloc[inicio:inicio + FILAS_POR_PAGINA],
+                use_container_width=True
+            )
+            
+            st.info(f"📊 Total de registros: {total} • Página {pagina} de {paginas}")
+        else:
+            st.warning("⚠️ No se pudo generar el análisis detallado")
+    
+    with result_tab2:
+        st.markdown("#### 📅 Resumen por Período Presupuestal")
+        st.dataframe(
+            vistas['periodo'],
+            use_container_width=True
+        )
+    
+    with result_tab3:
+        st.markdown("#### 🏢 Resumen por Centro Gestor")
+        st.dataframe(
+            vistas['centro'],
+            use_container_width=True
+        )
+    
+    with result_tab4:
+        st.markdown("#### 💰 Resumen por Tipo de Fondos")
+        st.dataframe(
+            vistas['fondos'],
+            use_container_width=True
+        )
+    
+    with result_tab5:
+        st.markdown("#### 🔍 Interpretaciones y Hallazgos")
+        for idx, row in interpretaciones.iterrows():
+            with st.expander(f"{row['Estado']} | {row['Categoría']}"):
+                st.markdown(f"**Hallazgo:** {row['Hallazgo']}")
+                st.markdown(f"**Interpretación:** {row['Interpretación']}")
+    
+    st.markdown("---")
+    
+    # Generar Excel
+    st.markdown("### 📥 Descargar Reporte Completo")
+    
+    with st.spinner("📊 Generando archivo Excel..."):
+        excel_bytes = generar_excel_bytes(file_hash, analizador)
+        
+        fecha_actual = datetime.now().strftime("%Y%m%d_%H%M%S")
+        nombre_archivo = f"ANALISIS_PAC_{fecha_actual}.xlsx"
+        
+        st.download_button(
+            label="⬇️ Descargar Análisis Completo (Excel)",
+            data=excel_bytes,
+            file_name=nombre_archivo,
+            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+            use_container_width=True,
+            type="primary"
+        )
+    
+    st.success("✅ Archivo Excel generado exitosamente")
+    st.info("📋 El archivo contiene 6 hojas: Resumen Ejecutivo, Análisis Detallado, Por Período, Por Centro Gestor, Por Fondos e Interpretaciones")
 
 # ============================================================
 # CONFIGURACIÓN DE STREAMLIT
@@ -545,7 +833,10 @@ st.set_page_config(
 # ESTILOS CSS
 # ============================================================
 
-st.markdown(f"""
+@st.cache_resource
+def _estilos_css() -> str:
+    """Hoja de estilos de la app; se arma una sola vez por proceso y no en cada rerun"""
+    return f"""
     <style>
     .main {{
         background-color: {WHITE};
@@ -641,26 +932,27 @@ st.markdown(f"""
         box-shadow: 0 2px 4px rgba(0,0,0,0.1);
     }}
     </style>
-""", unsafe_allow_html=True)
+"""
+
+st.markdown(_estilos_css(), unsafe_allow_html=True)
 
 # ============================================================
 # INICIALIZACIÓN DE SESSION STATE
 # ============================================================
 
-if "logged_in" not in st.session_state:
-    st.session_state.logged_in = False
-if "user" not in st.session_state:
-    st.session_state.user = ""
-if "rol" not in st.session_state:
-    st.session_state.rol = ""
-if "permisos" not in st.session_state:
-    st.session_state.permisos = []
-if "failed_attempts" not in st.session_state:
-    st.session_state.failed_attempts = 0
-if "lock_until" not in st.session_state:
-    st.session_state.lock_until = None
-if "historial_accesos" not in st.session_state:
-    st.session_state.historial_accesos = []
+# El diccionario se crea en cada rerun para que cada sesión reciba su propio deque
+# de historial (mutable) en lugar de compartir una misma instancia
+for clave_estado, valor_inicial in {
+    "logged_in": False,
+    "user": "",
+    "rol": "",
+    "permisos": frozenset(),
+    "failed_attempts": 0,
+    "lock_until": None,
+    "historial_accesos": deque(maxlen=MAX_HISTORIAL),
+    "analysis_key": None,
+}.items():
+    st.session_state.setdefault(clave_estado, valor_inicial)
 
 # ============================================================
 # SIDEBAR - LOGIN Y CONTROL
@@ -687,14 +979,16 @@ with st.sidebar:
     if not st.session_state.logged_in:
         with st.form("login_form"):
             st.markdown("#### Iniciar Sesión")
-            usuario = st.text_input("👤 Usuario", placeholder="Ingresa tu usuario")
-            clave = st.text_input("🔑 Contraseña", type="password", placeholder="Ingresa tu contraseña")
+            st.text_input("👤 Usuario", placeholder="Ingresa tu usuario", key="login_usuario")
+            st.text_input("🔑 Contraseña", type="password", placeholder="Ingresa tu contraseña", key="login_clave")
             
             if MOSTRAR_INTENTOS and st.session_state.failed_attempts > 0:
                 st.warning(f"⚠️ Intento {st.session_state.failed_attempts} de {MAX_INTENTOS}")
             
             col1, col2 = st.columns(2)
-            login_btn = col1.form_submit_button("🚀 Ingresar", use_container_width=True)
+            # El estado se actualiza en el callback, así el rerun del envío ya muestra
+            # la sesión iniciada (o el bloqueo) sin un st.rerun() adicional
+            col1.form_submit_button("🚀 Ingresar", use_container_width=True, on_click=procesar_login)
             help_btn = col2.form_submit_button("❓ Ayuda", use_container_width=True)
             
             if help_btn:
@@ -706,44 +1000,6 @@ with st.sidebar:
                 - auditor / audit2025
                 - jefe / jefe2025
                 """)
-            
-            if login_btn:
-                exito, datos_usuario = validar_login(usuario, clave)
-                
-                if exito:
-                    st.session_state.logged_in = True
-                    st.session_state.user = usuario.strip().lower()
-                    st.session_state.rol = datos_usuario["rol"]
-                    st.session_state.permisos = datos_usuario["permisos"]
-                    st.session_state.failed_attempts = 0
-                    
-                    st.session_state.historial_accesos.append({
-                        "usuario": st.session_state.user,
-                        "fecha": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                        "resultado": "Exitoso"
-                    })
-                    
-                    st.success(f"✅ Bienvenido {datos_usuario['rol']}")
-                    st.rerun()
-                else:
-                    st.session_state.failed_attempts += 1
-                    restantes = MAX_INTENTOS - st.session_state.failed_attempts
-                    
-                    st.session_state.historial_accesos.append({
-                        "usuario": usuario,
-                        "fecha": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                        "resultado": "Fallido"
-                    })
-                    
-                    if restantes > 0:
-                        st.error(f"❌ Credenciales incorrectas\n\n{restantes} intento(s) restante(s)")
-                    else:
-                        st.error("❌ Has agotado los intentos permitidos")
-                        st.session_state.lock_until = datetime.now() + timedelta(minutes=BLOQUEO_MINUTOS)
-                        st.warning(f"🔒 Bloqueado por {BLOQUEO_MINUTOS} minuto(s)")
-                        st.session_state.failed_attempts = 0
-                    
-                    st.rerun()
     
     else:
         st.success(f"✅ **Sesión Activa**")
@@ -754,14 +1010,7 @@ with st.sidebar:
         </div>
         """, unsafe_allow_html=True)
         
-        if st.button("🚪 Cerrar Sesión", use_container_width=True):
-            st.session_state.logged_in = False
-            st.session_state.user = ""
-            st.session_state.rol = ""
-            st.session_state.permisos = []
-            st.session_state.failed_attempts = 0
-            st.session_state.lock_until = None
-            st.rerun()
+        st.button("🚪 Cerrar Sesión", use_container_width=True, on_click=cerrar_sesion)
         
         st.markdown("---")
         
@@ -781,7 +1030,7 @@ with st.sidebar:
             st.markdown("#### 📋 Historial")
             with st.expander("Ver últimos accesos"):
                 if st.session_state.historial_accesos:
-                    for acceso in st.session_state.historial_accesos[-5:]:
+                    for acceso in list(st.session_state.historial_accesos)[-5:]:
                         resultado_icon = "✅" if acceso["resultado"] == "Exitoso" else "❌"
                         st.caption(f"{resultado_icon} {acceso['usuario']} - {acceso['fecha']}")
                 else:
@@ -795,11 +1044,14 @@ st.title("🏛️ Alcaldía Local de Usme")
 st.caption("Sistema de Análisis PAC • Plan Anual de Caja")
 
 if st.session_state.logged_in:
-    col1, col2, col3, col4 = st.columns(4)
-    col1.info(f"👤 **Usuario:** {st.session_state.user}")
-    col2.info(f"👔 **Rol:** {st.session_state.rol}")
-    col3.info(f"📅 **Fecha:** {datetime.now().strftime('%d/%m/%Y')}")
-    col4.info(f"🕐 **Hora:** {datetime.now().strftime('%H:%M:%S')}")
+    # Un solo elemento; la hora va al minuto para que el texto no cambie entre reruns seguidos
+    ahora = datetime.now()
+    st.info(
+        f"👤 **Usuario:** {st.session_state.user} • "
+        f"👔 **Rol:** {st.session_state.rol} • "
+        f"📅 **Fecha:** {ahora.strftime('%d/%m/%Y')} • "
+        f"🕐 **Hora:** {ahora.strftime('%H:%M')}"
+    )
 
 st.markdown("---")
 
@@ -808,10 +1060,12 @@ st.markdown("---")
 # ============================================================
 
 if not st.session_state.logged_in:
-    st.warning("🔒 **Acceso Restringido**")
-    st.info("Por favor, inicia sesión desde el panel izquierdo para acceder al sistema de análisis PAC.")
-    
+    # Aviso y presentación en un solo elemento
     st.markdown("""
+    <div class="info-card">
+        <p><strong>🔒 Acceso Restringido</strong></p>
+        <p>Por favor, inicia sesión desde el panel izquierdo para acceder al sistema de análisis PAC.</p>
+    </div>
     <div class="info-card">
         <h4>📊 Sistema de Análisis PAC</h4>
         <p>Este sistema permite analizar reportes del Plan Anual de Caja con:</p>
@@ -829,10 +1083,11 @@ elif not tiene_permiso("analisis_pac"):
     st.warning(f"Tu rol ({st.session_state.rol}) no tiene permisos para análisis PAC.")
 
 else:
-    st.subheader("📊 Análisis Completo de Reportes PAC")
-    st.success("✅ **Acceso Autorizado** - Puedes analizar reportes PAC")
-    
     st.markdown("""
+    <h3>📊 Análisis Completo de Reportes PAC</h3>
+    <div class="info-card">
+        <p><strong>✅ Acceso Autorizado</strong> - Puedes analizar reportes PAC</p>
+    </div>
     <div class="info-card">
         <h4>📋 Análisis Disponibles</h4>
         <ul>
@@ -843,10 +1098,9 @@ else:
             <li>🔍 <strong>Interpretaciones</strong> - Hallazgos automáticos</li>
         </ul>
     </div>
+    <hr>
     """, unsafe_allow_html=True)
     
-    st.markdown("---")
-    
     # Uploader
     archivo_pac = st.file_uploader(
         "📤 Subir Archivo Reporte PAC",
@@ -856,192 +1110,34 @@ else:
     
     if archivo_pac is not None:
         try:
-            # Leer archivo
+            # Leer archivo (en caché: los reruns no vuelven a parsear el Excel)
+            file_bytes = archivo_pac.getvalue()
+            file_hash = hashlib.sha256(file_bytes).hexdigest()
             with st.spinner("📂 Cargando datos..."):
-                df = pd.read_excel(archivo_pac, sheet_name='Data')
+                df = _load_pac(file_hash, file_bytes)
             
             st.success(f"✅ Archivo cargado: {len(df)} registros encontrados")
             
-            # Mostrar preview
-            with st.expander("👁️ Vista previa de datos (primeras 10 filas)"):
-                st.dataframe(df.head(10), use_container_width=True)
+            # Mostrar preview solo a pedido: un expander cerrado igual envía la tabla al navegador
+            if st.toggle("👁️ Vista previa de datos (primeras 10 filas)", key="_preview_open"):
+                st.dataframe(df.head(10).iloc[:, :15].astype(str), use_container_width=True)
             
             # Botón de análisis
-            if st.button("🚀 Iniciar Análisis Completo", type="primary", use_container_width=True):
+            # El botón solo marca el archivo analizado; los resultados se muestran en
+            # cada rerun desde la caché (cambiar de pestaña o descargar no recalcula)
+            analisis_nuevo = st.button("🚀 Iniciar Análisis Completo", type="primary", use_container_width=True)
+            if analisis_nuevo:
+                st.session_state.analysis_key = file_hash
+            
+            if st.session_state.analysis_key == file_hash:
                 with st.spinner("⚡ Procesando análisis... Por favor espera."):
                     try:
-                        # Crear analizador
-                        analizador = AnalizadorPAC(df)
-                        analizador.limpiar_datos()
-                        
-                        # Progress bar
-                        progress_bar = st.progress(0)
-                        status_text = st.empty()
-                        
-                        # Ejecutar análisis
-                        status_text.text("📊 Generando análisis detallado...")
-                        analizador.resumen_detallado_completo()
-                        progress_bar.progress(15)
-                        
-                        status_text.text("📅 Analizando por período...")
-                        analizador.resumen_por_periodo()
-                        progress_bar.progress(35)
-                        
-                        status_text.text("🏢 Analizando por centro gestor...")
-                        analizador.resumen_por_centro()
-                        progress_bar.progress(55)
-                        
-                        status_text.text("💰 Analizando por fondos...")
-                        analizador.resumen_por_fondos()
-                        progress_bar.progress(70)
-                        
-                        status_text.text("📈 Calculando disponibilidad...")
-                        analizador.analisis_disponibilidad()
-                        progress_bar.progress(85)
-                        
-                        status_text.text("⚡ Analizando ejecución...")
-                        analizador.analisis_ejecucion()
-                        progress_bar.progress(95)
-                        
-                        status_text.text("🔍 Generando interpretaciones...")
-                        interpretaciones = analizador.generar_interpretaciones()
-                        progress_bar.progress(100)
-                        
-                        status_text.text("✅ ¡Análisis completado!")
-                        
+                        resultados = ejecutar_analisis(file_hash, file_bytes)
                         st.success("🎉 **¡Análisis Completado Exitosamente!**")
                         
-                        # Mostrar métricas principales
-                        st.markdown("### 📊 Métricas Principales")
-                        
-                        disp = analizador.analisis['disponibilidad']
-                        
-                        col1, col2, col3, col4 = st.columns(4)
-                        col1.metric(
-                            "💰 PAC Total",
-                            f"${disp['total_pac']:,.0f}"
-                        )
-                        col2.metric(
-                            "✅ Ejecutado",
-                            f"${disp['total_ejecutado']:,.0f}",
-                            f"{disp['ejecucion_pct']:.1f}%"
-                        )
-                        col3.metric(
-                            "📊 Disponible",
-                            f"${disp['total_disponible']:,.0f}",
-                            f"{disp['disponibilidad_pct']:.1f}%"
-                        )
-                        col4.metric(
-                            "⚠️ Sobregiros",
-                            disp['registros_sobregiro'],
-                            "CRÍTICO" if disp['registros_sobregiro'] > 0 else "OK"
-                        )
-                        
-                        st.markdown("---")
-                        
-                        # Tabs de resultados
-                        result_tab1, result_tab2, result_tab3, result_tab4, result_tab5 = st.tabs([
-                            "📊 Análisis Detallado", "📅 Por Período", "🏢 Por Centro", "💰 Por Fondos", "🔍 Interpretaciones"
-                        ])
-                        
-                        with result_tab1:
-                            st.markdown("#### 📊 Análisis Detallado Completo")
-                            if analizador.resumen_detallado is not None and len(analizador.resumen_detallado) > 0:
-                                # Formatear columnas para visualización
-                                formato_dict = {}
-                                for col in analizador.resumen_detallado.columns:
-                                    if 'PAC' in col or 'Girado' in col or 'Disponibilidad' in col:
-                                        formato_dict[col] = '${:,.0f}'
-                                    elif 'Ejecutado' in col or '%' in col:
-                                        formato_dict[col] = '{:.2f}%'
-                                
-                                st.dataframe(
-                                    analizador.resumen_detallado.style.format(formato_dict),
-                                    use_container_width=True,
-                                    height=600
-                                )
-                                
-                                st.info(f"📊 Total de registros: {len(analizador.resumen_detallado)}")
-                            else:
-                                st.warning("⚠️ No se pudo generar el análisis detallado")
-                        
-                        with result_tab2:
-                            st.markdown("#### 📅 Resumen por Período Presupuestal")
-                            st.dataframe(
-                                analizador.resumen_periodo.style.format({
-                                    'PAC inicial': '${:,.0f}',
-                                    'PAC Actual': '${:,.0f}',
-                                    'PAC Reprogramado': '${:,.0f}',
-                                    'Girado y Recaudado PAC': '${:,.0f}',
-                                    'Disponibilidad PAC': '${:,.0f}',
-                                    'Ejecución %': '{:.1f}%',
-                                    'Disponibilidad %': '{:.1f}%',
-                                    'Variación PAC': '${:,.0f}',
-                                    'Variación %': '{:.1f}%'
-                                }),
-                                use_container_width=True
-                            )
-                        
-                        with result_tab3:
-                            st.markdown("#### 🏢 Resumen por Centro Gestor")
-                            st.dataframe(
-                                analizador.resumen_centro.head(20).style.format({
-                                    'PAC Actual': '${:,.0f}',
-                                    'Girado y Recaudado PAC': '${:,.0f}',
-                                    'Disponibilidad PAC': '${:,.0f}',
-                                    'Ejecución %': '{:.1f}%'
-                                }),
-                                use_container_width=True
-                            )
-                        
-                        with result_tab4:
-                            st.markdown("#### 💰 Resumen por Tipo de Fondos")
-                            st.dataframe(
-                                analizador.resumen_fondos.style.format({
-                                    'PAC Actual': '${:,.0f}',
-                                    'Girado y Recaudado PAC': '${:,.0f}',
-                                    'Disponibilidad PAC': '${:,.0f}',
-                                    'Ejecución %': '{:.1f}%'
-                                }),
-                                use_container_width=True
-                            )
-                        
-                        with result_tab5:
-                            st.markdown("#### 🔍 Interpretaciones y Hallazgos")
-                            for idx, row in interpretaciones.iterrows():
-                                with st.expander(f"{row['Estado']} | {row['Categoría']}"):
-                                    st.markdown(f"**Hallazgo:** {row['Hallazgo']}")
-                                    st.markdown(f"**Interpretación:** {row['Interpretación']}")
-                        
-                        st.markdown("---")
-                        
-                        # Generar Excel
-                        st.markdown("### 📥 Descargar Reporte Completo")
-                        
-                        with st.spinner("📊 Generando archivo Excel..."):
-                            wb = analizador.exportar_excel()
-                            
-                            # Guardar en bytes
-                            from io import BytesIO
-                            buffer = BytesIO()
-                            wb.save(buffer)
-                            buffer.seek(0)
-                            
-                            fecha_actual = datetime.now().strftime("%Y%m%d_%H%M%S")
-                            nombre_archivo = f"ANALISIS_PAC_{fecha_actual}.xlsx"
-                            
-                            st.download_button(
-                                label="⬇️ Descargar Análisis Completo (Excel)",
-                                data=buffer,
-                                file_name=nombre_archivo,
-                                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                                use_container_width=True,
-                                type="primary"
-                            )
-                        
-                        st.success("✅ Archivo Excel generado exitosamente")
-                        st.info("📋 El archivo contiene 6 hojas: Resumen Ejecutivo, Análisis Detallado, Por Período, Por Centro Gestor, Por Fondos e Interpretaciones")
-                        st.balloons()
+                        mostrar_resultados(file_hash, resultados)
+                        if analisis_nuevo:
+                            st.balloons()
                     
                     except Exception as e:
                         st.error("❌ **Error durante el análisis**")
@@ -1055,8 +1151,8 @@ else:
 # FOOTER
 # ============================================================
 
-st.markdown("---")
 st.markdown("""
+<hr>
 <div style='text-align: center; color: gray; padding: 20px;'>
     <p>🏛️ <strong>Alcaldía Local de Usme</strong> • Sistema de Análisis PAC</p>
     <p>📍 Bogotá D.C., Colombia • 📞 Contacto: (320) 830-38-47</p>